@@ -1,112 +1,579 @@
+from __future__ import annotations
+
 import streamlit as st
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-import folium
-from streamlit_folium import st_folium
-from shapely.geometry import mapping
-import tempfile
+import shapely
+import orjson
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import shutil
 import requests
+from requests.adapters import HTTPAdapter
 import io
 
 st.set_page_config(layout="wide", page_title="Latitude Farm Polygon Viewer")
 
 st.title("Latitude Farm Polygon Viewer")
 
-@st.cache_data
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ltcpv')
+
+# pyogrio reads straight into Arrow buffers when asked; set before any read
+os.environ.setdefault('PYOGRIO_USE_ARROW', '1')
+
+def _etag(url: str) -> str:
+    try:
+        resp = _session.head(url, timeout=10, allow_redirects=True)
+        return resp.headers.get('ETag', '')
+    except requests.RequestException:
+        return ''
+
 def download_file_to_temp(url: str) -> str:
-    resp = requests.get(url)
-    resp.raise_for_status()
+    """Download url into CACHE_DIR with HTTP revalidation: one conditional
+    GET carrying If-None-Match, reusing the on-disk copy on 304. Survives
+    process restarts and refetches as soon as the remote file changes."""
     suffix = '.kml' if url.lower().endswith('.kml') or '.kml?' in url.lower() else '.xlsx'
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tmp.write(resp.content)
-    tmp.flush()
-    tmp.close()
-    return tmp.name
+    base = os.path.join(CACHE_DIR, hashlib.sha1(url.encode()).hexdigest())
+    path, etag_path = base + suffix, base + '.etag'
+    headers = {}
+    if os.path.exists(path) and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            headers['If-None-Match'] = f.read()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    resp = _session.get(url, stream=True, headers=headers)
+    if resp.status_code == 304:
+        resp.close()
+        return path
+    resp.raise_for_status()
+    resp.raw.decode_content = True
+    with resp, open(path + '.part', 'wb') as tmp:
+        # stream straight to disk in 1 MB chunks instead of buffering the
+        # whole body in memory first
+        shutil.copyfileobj(resp.raw, tmp, length=1 << 20)
+    os.replace(path + '.part', path)
+    etag = resp.headers.get('ETag', '')
+    if etag:
+        with open(etag_path, 'w') as f:
+            f.write(etag)
+    elif os.path.exists(etag_path):
+        os.remove(etag_path)
+    return path
+
+_KML_NS = '{http://www.opengis.net/kml/2.2}'
+
+def _parse_kml(path: str) -> gpd.GeoDataFrame:
+    """Parse KML Placemark polygons directly with lxml, skipping the GDAL
+    KML driver and its per-feature Python dicts."""
+    from lxml import etree
+    names, rings = [], []
+    for _, pm in etree.iterparse(path, tag=_KML_NS + 'Placemark'):
+        name_el = pm.find(_KML_NS + 'name')
+        coords_el = pm.find('.//%souterBoundaryIs/%sLinearRing/%scoordinates' % ((_KML_NS,) * 3))
+        if coords_el is None:
+            coords_el = pm.find('.//' + _KML_NS + 'coordinates')
+        if coords_el is not None and coords_el.text:
+            try:
+                # tokens are "lon,lat[,alt]"; keep lon/lat only
+                coords = np.array([t.split(',')[:2] for t in coords_el.text.split()], dtype=np.float64)
+                ring = shapely.linearrings(coords)
+            except Exception:
+                pm.clear()
+                continue  # skip malformed or non-polygon placemarks
+            rings.append(ring)
+            names.append(name_el.text if name_el is not None and name_el.text else '')
+        pm.clear()  # free the parsed subtree as we stream
+    if not rings:
+        raise ValueError('no polygon placemarks found')
+    # one vectorized GEOS call builds every polygon from its ring
+    geoms = shapely.polygons(np.array(rings, dtype=object))
+    return gpd.GeoDataFrame({'Name': names}, geometry=geoms, crs='epsg:4326')
 
 @st.cache_data
 def read_kml_from_url(url: str) -> gpd.GeoDataFrame:
     tmp_path = download_file_to_temp(url)
-    gdf = gpd.read_file(tmp_path, driver='KML')
+    try:
+        gdf = _parse_kml(tmp_path)
+    except Exception:
+        try:
+            # pyogrio reads through the GDAL C API into columnar buffers,
+            # far faster than fiona's per-feature Python round trip
+            gdf = gpd.read_file(tmp_path, engine='pyogrio', use_arrow=True)
+        except Exception:
+            gdf = gpd.read_file(tmp_path, driver='KML')
     if 'Name' not in gdf.columns and 'name' in gdf.columns:
         gdf = gdf.rename(columns={'name': 'Name'})
     if 'Name' not in gdf.columns:
         gdf['Name'] = gdf.index.astype(str)
     gdf['Name'] = gdf['Name'].astype(str)
-    return gdf
+    # KML is WGS84 by definition; stamp it rather than trusting whatever
+    # variant the driver reports, so prepare_data never reprojects KML input
+    return gdf.set_crs('epsg:4326', allow_override=True)
 
 @st.cache_data
 def read_excel_from_url(url: str) -> pd.DataFrame:
-    resp = requests.get(url)
+    resp = _session.get(url, stream=True)
     resp.raise_for_status()
-    df = pd.read_excel(io.BytesIO(resp.content), engine='openpyxl')
+    bio = io.BytesIO()
+    resp.raw.decode_content = True
+    with resp:
+        shutil.copyfileobj(resp.raw, bio, length=1 << 20)
+    bio.seek(0)
+    try:
+        # calamine parses xlsx in Rust, several times faster than openpyxl's
+        # per-cell Python objects
+        # dtype=str up front: every consumer treats these as strings, so this
+        # avoids a later astype copy of each column
+        df = pd.read_excel(bio, engine='calamine', dtype=str)
+    except (ImportError, ValueError):
+        # ImportError: python-calamine not installed; ValueError: pandas
+        # older than 2.2, which doesn't know the engine at all
+        bio.seek(0)
+        df = pd.read_excel(bio, engine='openpyxl', dtype=str)
     df.columns = [c.strip() for c in df.columns]
     return df
 
+@dataclass(frozen=True)
+class ColSpec:
+    """The Excel columns the app actually uses, discovered once."""
+    farmer: str
+    village: str = None
+    group: str = None
+
+_FARMER_NAMES = ('farmercode', 'farmer_code', 'code', 'farmer code')
+_VILLAGE_NAMES = ('village', 'village_name')
+_GROUP_NAMES = ('group', 'group_name')
+
+def _normalize_codes(values: np.ndarray, width: int = None) -> np.ndarray:
+    """Upper-cased, stripped (optionally width-truncated) code strings in one
+    pass. Dispatches to pyarrow.compute's SIMD utf8 kernels when available;
+    otherwise numpy's fixed-width char ops."""
+    values = np.asarray(values)
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        arr = pa.array(values.astype(str))
+        if width:
+            # truncate before trimming, matching the numpy path's fixed-width
+            # cast so join keys don't depend on which backend ran
+            arr = pc.utf8_slice_codeunits(arr, 0, width)
+        arr = pc.utf8_trim_whitespace(pc.utf8_upper(arr))
+        return arr.to_numpy(zero_copy_only=False)
+    except ImportError:
+        out = values.astype(f'U{width}') if width else values.astype('U')
+        return np.char.strip(np.char.upper(out))
+
+def _col_spec(columns) -> ColSpec:
+    # one normalized lookup dict instead of re-stripping the header per scan
+    col_map = {c.strip().lower(): c for c in columns}
+    return ColSpec(
+        farmer=next((col_map[k] for k in _FARMER_NAMES if k in col_map), list(columns)[0]),
+        village=next((col_map[k] for k in _VILLAGE_NAMES if k in col_map), None),
+        group=next((col_map[k] for k in _GROUP_NAMES if k in col_map), None),
+    )
+
 @st.cache_data
-def prepare_data(_kml_gdf: gpd.GeoDataFrame, groups_df: pd.DataFrame):
+def prepare_excel(groups_df: pd.DataFrame):
     df = groups_df.copy()
-    farmer_col = next((col for col in df.columns if col.strip().lower() in ['farmercode', 'farmer_code', 'code', 'farmer code']), df.columns[0])
-    df[farmer_col] = df[farmer_col].astype(str).str.upper().str.strip()
+    spec = _col_spec(df.columns)
+    # one vectorized pass instead of chained pandas str ops that allocate an
+    # intermediate column per step
+    df[spec.farmer] = _normalize_codes(df[spec.farmer].to_numpy())
+    return df, spec
+
+@st.cache_data
+def prepare_data(_kml_gdf: gpd.GeoDataFrame, groups_df: pd.DataFrame):
+    df, spec = prepare_excel(groups_df)
+    farmer_col = spec.farmer
     kg = _kml_gdf.copy()
     kg['Name'] = kg['Name'].astype(str)
-    kg['code8'] = kg['Name'].str[:8].str.upper().str.strip()
-    valid_codes = set(df[farmer_col])
-    kg = kg[kg['code8'].isin(valid_codes)].reset_index(drop=True)
-    kg = kg.merge(df, left_on='code8', right_on=farmer_col, how='left', suffixes=(None, '_excel'))
+    # width=8 truncates to the farmer code prefix in the same pass
+    kg['code8'] = _normalize_codes(kg['Name'].to_numpy(), width=8)
+    # one indexed lookup table serves both the filter and the join, instead
+    # of building a python set plus merge's two-sided hash tables; carry only
+    # the columns the popups and filters read, not the whole Excel sheet
+    keep = [c for c in (spec.village, spec.group) if c]
+    lookup = df.drop_duplicates(farmer_col).set_index(farmer_col)[keep]
+    kg = kg[kg['code8'].isin(lookup.index)].reset_index(drop=True)
+    kg = kg.join(lookup, on='code8', rsuffix='_excel', validate='m:1')
+    kg[farmer_col] = kg['code8']
+    # categorical code8: dedupes label storage and lets the prefix search
+    # scan category labels instead of every row
+    kg['code8'] = kg['code8'].astype('category')
+    # village/group as categoricals up front: the filter index groups on the
+    # int codes and only normalizes the small label set, and the dtype
+    # survives the GeoParquet round trip so warm restarts skip this too
+    for _c in (spec.village, spec.group):
+        if _c and _c in kg.columns:
+            kg[_c] = kg[_c].astype('category')
     if kg.crs is None:
         kg = kg.set_crs('epsg:4326')
-    else:
+    elif kg.crs.to_epsg() != 4326:
+        # KML is WGS84 in practice; only reproject when it genuinely isn't,
+        # since to_crs runs a PROJ transform over every vertex
         kg = kg.to_crs(epsg=4326)
-    # Create village-to-group and group-to-village mappings
-    village_group_map = {}
-    group_village_map = {}
-    for village in df[village_col].dropna().unique() if 'village_col' in globals() else []:
-        village_group_map[village] = sorted(df[df[village_col] == village][group_col].dropna().unique()) if 'group_col' in globals() else []
-    for group in df[group_col].dropna().unique() if 'group_col' in globals() else []:
-        group_village_map[group] = sorted(df[df[group_col] == group][village_col].dropna().unique()) if 'village_col' in globals() else []
-    return kg, df, farmer_col, village_group_map, group_village_map
-
-def folium_map_for_gdf(gdf: gpd.GeoDataFrame, popup_fields=None, initial_zoom=12):
+    village_group_map, group_village_map = _village_group_maps(df, spec)
+    return kg, df, spec, village_group_map, group_village_map
+
+def _village_group_maps(df: pd.DataFrame, spec: ColSpec):
+    """Village-to-group and group-to-village mappings for the linked
+    sidebar filters."""
+    if not (spec.village and spec.group):
+        return {}, {}
+    pairs = df[[spec.village, spec.group]].dropna().drop_duplicates()
+    village_group_map = {v: sorted(g) for v, g in pairs.groupby(spec.village, observed=True)[spec.group]}
+    group_village_map = {g: sorted(v) for g, v in pairs.groupby(spec.group, observed=True)[spec.village]}
+    return village_group_map, group_village_map
+
+MAX_RAW_COORDS = 200_000   # above this, render simplified geometry instead
+COORD_GRID = 1e-5          # snap coords to this grid before serializing
+DISPLAY_TOL = 1e-4         # Douglas-Peucker tolerance for display geometry
+
+_simplified_cache = {}
+
+def simplified_wkb_for(kg: gpd.GeoDataFrame):
+    """Display geometries simplified on demand, held as WKB bytes (far less
+    memory than live shapely objects) in a small cache keyed on the frame's
+    identity. Returns None when the originals are small enough to ship."""
+    key = _frame_key(kg)
+    if key not in _simplified_cache:
+        while len(_simplified_cache) >= 8:
+            _simplified_cache.pop(next(iter(_simplified_cache)))
+        # one vectorized GEOS call instead of walking each geometry in Python
+        geoms = np.asarray(kg.geometry.values)
+        if int(shapely.get_num_coordinates(geoms).sum()) <= MAX_RAW_COORDS:
+            wkb = None
+        else:
+            # Douglas-Peucker (vectorized, topology checks skipped for
+            # display-only output), then a grid snap that dedups collapsed
+            # vertices and keeps rings legal
+            lod = shapely.simplify(geoms, DISPLAY_TOL, preserve_topology=False)
+            lod = shapely.set_precision(lod, grid_size=COORD_GRID, mode='valid_output')
+            # rows the tolerance collapsed entirely (farm plots smaller than
+            # the tolerance) get the plain grid snap instead of vanishing
+            empty = shapely.is_empty(lod)
+            if empty.any():
+                lod[empty] = shapely.set_precision(geoms[empty], grid_size=COORD_GRID, mode='valid_output')
+            wkb = shapely.to_wkb(lod)
+        _simplified_cache[key] = wkb
+    return _simplified_cache[key]
+
+def load_prepared(kml_url: str, excel_url: str):
+    """Download, merge and simplify the polygons, with an on-disk GeoParquet
+    cache keyed on URLs + ETags so cold restarts skip the KML parse."""
+    # the two fetches are independent blocking I/O, so overlap them; the GIL
+    # is released while the threads sit in recv()
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        excel_future = ex.submit(read_excel_from_url, excel_url)
+        key = hashlib.sha1('|'.join((kml_url, _etag(kml_url), excel_url, _etag(excel_url))).encode()).hexdigest()
+        parquet_path = os.path.join(CACHE_DIR, key + '.parquet')
+        cached = None
+        if os.path.exists(parquet_path):
+            try:
+                cached = gpd.read_parquet(parquet_path)
+            except Exception:
+                cached = None  # truncated or stale cache file; rebuild below
+        kml_future = None if cached is not None else ex.submit(read_kml_from_url, kml_url)
+        groups_df = excel_future.result()
+        df_excel, spec = prepare_excel(groups_df)
+        if cached is not None:
+            cached.attrs['_rev'] = uuid.uuid4().hex
+            village_group_map, group_village_map = _village_group_maps(df_excel, spec)
+            return cached, df_excel, spec, village_group_map, group_village_map
+        kml_gdf = kml_future.result()
+    kg, df_excel, spec, village_group_map, group_village_map = prepare_data(kml_gdf, groups_df)
+    kg.attrs['_rev'] = uuid.uuid4().hex
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        kg.to_parquet(parquet_path, compression='zstd')
+    except Exception:
+        pass  # cache is best-effort; failing to write only costs restart time
+    return kg, df_excel, spec, village_group_map, group_village_map
+
+def _frame_key(kg: gpd.GeoDataFrame):
+    """Cache key for a prepared frame: the revision stamped by load_prepared,
+    so a recycled id() can never serve rows computed for an older dataset.
+    Falls back to id() for frames that didn't come through load_prepared."""
+    return kg.attrs.get('_rev') or id(kg)
+
+@st.cache_data(max_entries=16, hash_funcs={gpd.GeoDataFrame: _frame_key})
+def _group_indices(kg: gpd.GeoDataFrame, col: str) -> dict:
+    """Map each normalized value of `col` to the row positions holding it."""
+    s = kg[col]
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # group on the int codes and normalize only the label set, instead
+        # of running four string ops over the full column
+        labels = s.cat.categories.astype(str).str.strip().str.lower()
+        out = {}
+        for code, pos in kg.groupby(s.cat.codes.to_numpy()).indices.items():
+            if code < 0:
+                continue  # NaN rows
+            lab = labels[code]
+            out[lab] = pos if lab not in out else np.concatenate([out[lab], pos])
+        return out
+    keys = s.astype(str).str.strip().str.lower()
+    return dict(kg.groupby(keys.to_numpy()).indices)
+
+_EMPTY_IDX = np.array([], dtype=np.intp)
+
+@st.cache_data(max_entries=8, hash_funcs={gpd.GeoDataFrame: _frame_key})
+def _code_index(kg: gpd.GeoDataFrame):
+    """Category labels of code8 as an (n_cats, 8) byte table plus a
+    label -> row positions dict, built once per frame."""
+    codes = kg['code8']
+    if not isinstance(codes.dtype, pd.CategoricalDtype):
+        codes = codes.astype('category')
+    cats = codes.cat.categories.to_numpy()
+    cat_bytes = cats.astype('S8').view('S1').reshape(-1, 8)
+    return cat_bytes, cats, dict(kg.groupby(codes, observed=True).indices)
+
+def _prefix_mask(code_bytes: np.ndarray, prefix: str) -> np.ndarray:
+    """Vectorized memcmp of the first len(prefix) bytes of each code."""
+    target = np.frombuffer(prefix.encode()[:8], dtype='S1')
+    return (code_bytes[:, :len(target)] == target).all(axis=1)
+
+@st.cache_data(max_entries=64, hash_funcs={gpd.GeoDataFrame: _frame_key})
+def filter_indices(kg: gpd.GeoDataFrame, village_col, group_col,
+                   search_code: str, village_sel: str, group_sel: str) -> np.ndarray:
+    """Resolve the sidebar selection to row positions using precomputed
+    per-value index arrays, so a rerun costs O(result) not O(len(kg))."""
+    # start unconstrained (None) so the first active filter sets the index
+    # directly instead of intersecting against a full arange
+    idx = None
+    if village_col and village_sel != '(any)':
+        idx = np.sort(_group_indices(kg, village_col).get(village_sel.lower(), _EMPTY_IDX))
+    if group_col and group_sel != '(any)':
+        hits = _group_indices(kg, group_col).get(group_sel.lower(), _EMPTY_IDX)
+        idx = np.sort(hits) if idx is None else np.intersect1d(idx, hits)
+    if search_code:
+        # match against the (small) category label table, then splice the
+        # precomputed row positions of the hits
+        cat_bytes, cats, idx_by_code = _code_index(kg)
+        hit = _prefix_mask(cat_bytes, search_code.strip().upper())
+        matched = np.concatenate([idx_by_code[c] for c in cats[hit]]) if hit.any() else _EMPTY_IDX
+        idx = np.sort(matched) if idx is None else np.intersect1d(idx, matched)
+    return np.arange(len(kg)) if idx is None else idx
+
+@st.cache_data(max_entries=8, hash_funcs={gpd.GeoDataFrame: _frame_key})
+def _row_bounds(kg: gpd.GeoDataFrame) -> np.ndarray:
+    """(N, 4) per-row envelopes from one vectorized GEOS pass, computed once
+    per frame identity."""
+    return shapely.bounds(np.asarray(kg.geometry.values))
+
+_bounds_cache = {}
+
+def bounds_for(kg: gpd.GeoDataFrame, idx: np.ndarray = None) -> tuple:
+    """(minx, miny, maxx, maxy) of the given row subset, reduced from the
+    precomputed envelope table instead of re-walking geometries in GEOS.
+    Memoized per selection so pan/zoom reruns skip even the reduction."""
+    subset = idx is not None and len(idx) != len(kg)
+    key = (_frame_key(kg), hash(idx.tobytes()) if subset else None)
+    if key not in _bounds_cache:
+        while len(_bounds_cache) >= 32:
+            _bounds_cache.pop(next(iter(_bounds_cache)))
+        b = _row_bounds(kg)
+        if subset:
+            b = b[idx]
+        _bounds_cache[key] = (*b[:, :2].min(axis=0), *b[:, 2:].max(axis=0))
+    return _bounds_cache[key]
+
+def _extract_outer_rings(geoms: np.ndarray) -> np.ndarray:
+    """deck.gl-ready outer rings via one bulk to_ragged_array extraction."""
+    types = shapely.get_type_id(geoms)
+    if (types == shapely.GeometryType.MULTIPOLYGON).any():
+        # precision snapping can split an invalid polygon into parts; keep
+        # the largest so rows stay aligned with the rest of the frame
+        geoms = geoms.copy()
+        for i in np.flatnonzero(types == shapely.GeometryType.MULTIPOLYGON):
+            parts = shapely.get_parts(geoms[i])
+            geoms[i] = parts[np.argmax(shapely.area(parts))]
+    geom_type, coords, offsets = shapely.to_ragged_array(geoms)
+    if geom_type != shapely.GeometryType.POLYGON:
+        raise ValueError('WebGL path only handles plain polygons')
+    ring_offsets, poly_offsets = offsets
+    out = np.empty(len(geoms), dtype=object)
+    for i in range(len(geoms)):
+        out[i] = coords[ring_offsets[poly_offsets[i]]:ring_offsets[poly_offsets[i] + 1]].tolist()
+    return out
+
+@st.cache_data(max_entries=4, hash_funcs={gpd.GeoDataFrame: _frame_key})
+def _outer_rings(kg: gpd.GeoDataFrame) -> np.ndarray:
+    """Outer rings for the whole dataset, extracted once per frame identity
+    so each map interaction only slices precomputed lists."""
+    wkb = simplified_wkb_for(kg)
+    geoms = shapely.from_wkb(wkb) if wkb is not None else np.asarray(kg.geometry.values)
+    return _extract_outer_rings(geoms)
+
+def deck_for_gdf(gdf: gpd.GeoDataFrame, rings=None, initial_zoom=12, bounds=None) -> pdk.Deck:
+    """Build a deck.gl PolygonLayer from precomputed rings (or extract them
+    in one vectorized pass when none are supplied)."""
+    import pydeck as pdk
+    outer = list(rings) if rings is not None else list(_extract_outer_rings(np.asarray(gdf.geometry.values)))
+    data = pd.DataFrame({
+        'polygon': outer,
+        'info': _popup_series(gdf).to_numpy(),
+    })
+    if bounds is None:
+        bounds = gdf.total_bounds
+    layer = pdk.Layer(
+        'PolygonLayer', data=data, get_polygon='polygon',
+        get_fill_color=[255, 255, 102, 80], get_line_color=[0, 0, 255],
+        line_width_min_pixels=1, pickable=True,
+    )
+    view = pdk.ViewState(latitude=(bounds[1] + bounds[3]) / 2,
+                         longitude=(bounds[0] + bounds[2]) / 2,
+                         zoom=initial_zoom)
+    return pdk.Deck(layers=[layer], initial_view_state=view, tooltip={'html': '{info}'})
+
+@st.cache_data(max_entries=8, hash_funcs={gpd.GeoDataFrame: _frame_key})
+def _dedup_info(kg: gpd.GeoDataFrame):
+    """Geometry-identity table for collapsing byte-identical polygons before
+    serialization: a key per row (equal keys = identical WKB), each key's
+    first row position, and the joined codes sharing a repeated geometry.
+    None when every geometry is unique — the common case, checked once."""
+    wkb = shapely.to_wkb(np.asarray(kg.geometry.values))
+    digests = np.array([hashlib.blake2b(b, digest_size=8).digest() for b in wkb], dtype='S8')
+    keys = pd.factorize(digests)[0]
+    n_keys = keys.max() + 1 if len(keys) else 0
+    if n_keys == len(kg):
+        return None
+    first = np.full(n_keys, len(kg), dtype=np.intp)
+    np.minimum.at(first, keys, np.arange(len(kg)))
+    codes = kg['code8'].astype(str).to_numpy()
+    shared = np.full(n_keys, '', dtype=object)
+    positions = pd.RangeIndex(len(kg)).groupby(keys)
+    for k in np.flatnonzero(np.bincount(keys) > 1):
+        shared[k] = ', '.join(sorted(set(codes[np.asarray(positions[k])])))
+    return keys, first, shared
+
+@st.cache_data
+def _options(df_excel: pd.DataFrame, village_col, group_col):
+    """Sorted unique sidebar options, computed once per Excel instead of on
+    every widget-triggered rerun. Tuples so the cached value is immutable."""
+    def uniq(col):
+        if not col:
+            return ()
+        return tuple(sorted(pd.unique(df_excel[col].dropna().astype(str))))
+    return uniq(village_col), uniq(group_col)
+
+def _display_frame(kg: gpd.GeoDataFrame, village_col, group_col,
+                   search_code: str, village_sel: str, group_sel: str, popup_fields):
+    """Resolve the selection to the frame actually handed to a renderer:
+    filtered rows, popup columns only, lazily-simplified geometry."""
+    idx = filter_indices(kg, village_col, group_col, search_code, village_sel, group_sel)
+    showing_all = len(idx) == 0
+    if showing_all:
+        idx = np.arange(len(kg))
+    # collapse byte-identical geometries to their first occurrence so the
+    # payload carries each polygon once; the filter indices above still see
+    # every row, so searching a collapsed code keeps working
+    dedup = _dedup_info(kg)
+    if dedup is not None:
+        keys, first, shared = dedup
+        idx = np.sort(first[np.unique(keys[idx])])
+    # no row take when every row is in: slicing columns off kg itself is
+    # enough, and the geometry/property blocks aren't duplicated
+    display_gdf = kg if len(idx) == len(kg) else kg.iloc[idx]
+    # ship only the columns the popups use; village/group repeat heavily so
+    # keep them as categoricals in memory
+    keep_cols = [c for c in dict.fromkeys(popup_fields) if c in display_gdf.columns]
+    geom_cols = [c for c in display_gdf.columns if display_gdf[c].dtype == 'geometry']
+    display_gdf = display_gdf[keep_cols + geom_cols]
+    if dedup is not None:
+        display_gdf = display_gdf.assign(_shared=shared[keys[idx]])
+    for c in (village_col, group_col):
+        if c in display_gdf.columns:
+            display_gdf[c] = display_gdf[c].astype('category')
+    # swap in lazily-simplified display geometry when the set is heavy
+    wkb = simplified_wkb_for(kg)
+    if wkb is not None:
+        display_gdf = display_gdf.set_geometry(gpd.GeoSeries(
+            shapely.from_wkb(wkb[idx]), index=display_gdf.index, crs=kg.crs))
+    return display_gdf, idx, showing_all
+
+@st.cache_resource(max_entries=32)
+def _build_map(search_code: str, village_sel: str, group_sel: str, data_rev) -> folium.Map:
+    """Reuse the folium map when the selection is unchanged; pan/zoom reruns
+    then skip the whole rebuild + GeoJSON serialization. The data itself is
+    read from session state so the cache key stays tiny."""
+    kg, village_col, group_col, popup_fields = st.session_state['_render_ctx']
+    display_gdf, idx, _ = _display_frame(kg, village_col, group_col,
+                                         search_code, village_sel, group_sel, popup_fields)
+    return folium_map_for_gdf(display_gdf, popup_fields=popup_fields,
+                              bounds=bounds_for(kg, idx))
+
+def _popup_series(gdf: gpd.GeoDataFrame) -> pd.Series:
+    """Popup HTML for every row in a handful of vectorized string concats,
+    instead of per-row f-string assembly."""
+    html = '<b>Name:</b> ' + gdf['Name'].astype(str) + '<br/>' if 'Name' in gdf.columns else pd.Series('', index=gdf.index)
+    if 'code8' in gdf.columns:
+        html = html + '<b>FarmerCode:</b> ' + gdf['code8'].astype(str) + '<br/>'
+    for c in ('Group', 'group', 'Village', 'village'):
+        if c in gdf.columns:
+            html = html + np.where(gdf[c].notna(), '<b>' + c + ':</b> ' + gdf[c].astype(str) + '<br/>', '')
+    if '_shared' in gdf.columns:
+        # codes whose rows were collapsed into this polygon's single feature
+        html = html + np.where(gdf['_shared'].astype(str) != '',
+                               '<b>Shared by:</b> ' + gdf['_shared'].astype(str) + '<br/>', '')
+    return html
+
+def _feature_collection_json(gdf: gpd.GeoDataFrame) -> str:
+    """FeatureCollection string with geometries serialized inside GEOS
+    (shapely.to_geojson, one vectorized call) and properties by orjson."""
+    geoms_json = shapely.to_geojson(np.asarray(gdf.geometry.values))
+    props = gdf.drop(columns=[c for c in gdf.columns if gdf[c].dtype == 'geometry'])
+    features = [
+        b'{"type":"Feature","geometry":' + geom.encode()
+        + b',"properties":' + orjson.dumps(rec, option=orjson.OPT_SERIALIZE_NUMPY, default=str) + b'}'
+        for geom, rec in zip(geoms_json, props.to_dict(orient='records'))
+    ]
+    return (b'{"type":"FeatureCollection","features":[' + b','.join(features) + b']}').decode()
+
+def folium_map_for_gdf(gdf: gpd.GeoDataFrame, popup_fields=None, initial_zoom=12, bounds=None):
+    import folium
     if len(gdf) == 0:
         return folium.Map(location=[0,0], zoom_start=2)
-    bounds = gdf.total_bounds
+    if bounds is None:
+        bounds = gdf.total_bounds
     center_lat = (bounds[1] + bounds[3]) / 2
     center_lon = (bounds[0] + bounds[2]) / 2
     m = folium.Map(location=[center_lat, center_lon], zoom_start=initial_zoom)
     popup_fields = popup_fields or ['Name', 'code8']
+    gdf = gdf.assign(_popup=_popup_series(gdf))
+    # Serialize the whole FeatureCollection in one pass instead of building
+    # per-feature dicts in Python; drop any extra geometry columns first
+    # since only the active one is serializable.
+    extra_geom_cols = [c for c in gdf.columns
+                       if c != gdf.geometry.name and gdf[c].dtype == 'geometry']
+    payload = gdf.drop(columns=extra_geom_cols) if extra_geom_cols else gdf
+    # snapping to a ~1 m grid collapses duplicate adjacent vertices and
+    # keeps the emitted coordinate digits short
+    snapped = gpd.GeoSeries(
+        shapely.set_precision(np.asarray(payload.geometry.values), COORD_GRID),
+        index=payload.index, crs=payload.crs)
+    payload = payload.set_geometry(snapped)
     try:
-        gj = folium.GeoJson(
-            gdf.__geo_interface__,
-            name='polygons',
-            tooltip=folium.GeoJsonTooltip(fields=['Name'], aliases=['Name:']),
-            style_function=lambda x: {'fillColor': '#ffff66', 'color': '#0000ff', 'weight': 2, 'fillOpacity': 0.3}
-        )
-        existing_fields = [f for f in popup_fields if f in gdf.columns]
-        if existing_fields:
-            gj.add_child(folium.features.GeoJsonPopup(fields=existing_fields, labels=True, localize=True))
-        gj.add_to(m)
+        # GEOS writes the geometry JSON, orjson the properties — no
+        # __geo_interface__ dict materialization at all
+        geojson_str = _feature_collection_json(payload)
     except Exception:
-        for _, row in gdf.iterrows():
-            try:
-                geo_json = {
-                    'type': 'Feature',
-                    'geometry': mapping(row.geometry),
-                    'properties': {col: row[col] for col in gdf.columns if col != 'geometry'}
-                }
-                popup_html = f"<b>Name:</b> {row.get('Name','')}<br/><b>FarmerCode:</b> {row.get('code8','')}<br/>"
-                for c in ['Group', 'group', 'Village', 'village']:
-                    if c in row and pd.notna(row.get(c)):
-                        popup_html += f"<b>{c}:</b> {row.get(c)}<br/>"
-                folium.GeoJson(
-                    geo_json,
-                    name=str(row.get('Name','')),
-                    tooltip=row.get('Name',''),
-                    style_function=lambda x: {'fillColor': '#ffff66', 'color': '#0000ff', 'weight': 2, 'fillOpacity': 0.3},
-                    highlight_function=lambda x: {'weight': 3, 'color': 'green'},
-                    popup=folium.Popup(popup_html, max_width=300)
-                ).add_to(m)
-            except Exception:
-                continue
+        # ujson fallback; double_precision=6 (~11 cm) keeps coords short
+        geojson_str = pd.io.json.ujson_dumps(payload.__geo_interface__, double_precision=6)
+    gj = folium.GeoJson(
+        geojson_str,
+        name='polygons',
+        tooltip=folium.GeoJsonTooltip(fields=['Name'], aliases=['Name:']),
+        style_function=lambda x: {'fillColor': '#ffff66', 'color': '#0000ff', 'weight': 2, 'fillOpacity': 0.3}
+    )
+    gj.add_child(folium.features.GeoJsonPopup(fields=['_popup'], labels=False))
+    gj.add_to(m)
     m.fit_bounds([[bounds[1] - 0.01, bounds[0] - 0.01], [bounds[3] + 0.01, bounds[2] + 0.01]])
     return m
 
@@ -114,31 +581,26 @@ _raw_base = "https://raw.githubusercontent.com/tuyishimeandrew/LTC-Polygon-Viewe
 kml_url = f"{_raw_base}/SurveyCTO%20Inspection%20Polygons.kml"
 excel_url = f"{_raw_base}/Group%20Polygons.xlsx"
 
-try:
-    kml_gdf = read_kml_from_url(kml_url)
-    groups_df = read_excel_from_url(excel_url)
-except Exception as e:
-    st.error(f'Error loading files: {e}')
-    st.stop()
-
-try:
-    kg, df_excel, farmer_col, village_group_map, group_village_map = prepare_data(kml_gdf, groups_df)
-except Exception as e:
-    st.error(f'Error preparing data: {e}')
-    st.stop()
+# keep one instance in session state so cached filters can key on identity
+if st.session_state.get('_data_src') != (kml_url, excel_url):
+    try:
+        st.session_state['_data'] = load_prepared(kml_url, excel_url)
+        st.session_state['_data_src'] = (kml_url, excel_url)
+    except Exception as e:
+        st.error(f'Error loading files: {e}')
+        st.stop()
+kg, df_excel, spec, village_group_map, group_village_map = st.session_state['_data']
+village_col, group_col = spec.village, spec.group
 
 popup_fields = ['Name', 'code8']
-if farmer_col and farmer_col in df_excel.columns:
-    popup_fields.append(farmer_col)
-for c in ['Village', 'village', 'Group', 'group']:
-    if c in df_excel.columns and c not in popup_fields:
+if spec.farmer in df_excel.columns:
+    popup_fields.append(spec.farmer)
+for c in (village_col, group_col):
+    if c and c not in popup_fields:
         popup_fields.append(c)
 
 st.sidebar.header('Filters')
 
-village_col = next((c for c in df_excel.columns if c.strip().lower() in ['village', 'village_name']), None)
-group_col = next((c for c in df_excel.columns if c.strip().lower() in ['group', 'group_name']), None)
-
 # Initialize session state for filters
 if 'village_sel' not in st.session_state:
     st.session_state.village_sel = '(any)'
@@ -146,8 +608,7 @@ if 'group_sel' not in st.session_state:
     st.session_state.group_sel = '(any)'
 
 # Get available options based on selections
-villages = sorted(df_excel[village_col].dropna().astype(str).unique()) if village_col else []
-groups = sorted(df_excel[group_col].dropna().astype(str).unique()) if group_col else []
+villages, groups = _options(df_excel, village_col, group_col)
 
 if st.session_state.group_sel != '(any)' and group_col and village_col:
     villages = group_village_map.get(st.session_state.group_sel, villages)
@@ -155,22 +616,32 @@ if st.session_state.village_sel != '(any)' and village_col and group_col:
     groups = village_group_map.get(st.session_state.village_sel, groups)
 
 # Update filters
-village_sel = st.sidebar.selectbox('Village', options=['(any)'] + villages, key='village_sel')
-group_sel = st.sidebar.selectbox('Group', options=['(any)'] + groups, key='group_sel')
-
-filtered = kg.copy()
-if village_col and village_sel != '(any)':
-    filtered = filtered[filtered[village_col].astype(str).str.strip().str.lower() == village_sel.lower()]
-if group_col and group_sel != '(any)':
-    filtered = filtered[filtered[group_col].astype(str).str.strip().str.lower() == group_sel.lower()]
+search_code = st.sidebar.text_input('Farmer code prefix', key='search_code').strip()
+village_sel = st.sidebar.selectbox('Village', options=['(any)'] + list(villages), key='village_sel')
+group_sel = st.sidebar.selectbox('Group', options=['(any)'] + list(groups), key='group_sel')
 
 if len(kg) == 0:
     st.warning('No polygons available.')
 else:
-    if len(filtered) == 0:
+    st.session_state['_render_ctx'] = (kg, village_col, group_col, popup_fields)
+    match_idx = filter_indices(kg, village_col, group_col, search_code, village_sel, group_sel)
+    if len(match_idx) == 0:
         st.info('No matches — showing all.')
-        display_gdf = kg
+    # deck.gl is the default renderer: the polygons ship to the GPU once as
+    # columnar buffers and pan/zoom never re-enters Python, where st_folium
+    # re-round-trips the whole GeoJSON over the component bridge on every
+    # interaction. folium remains the fallback for geometries the ring
+    # extractor can't handle.
+    try:
+        display_gdf, display_idx, _ = _display_frame(
+            kg, village_col, group_col, search_code, village_sel, group_sel, popup_fields)
+        deck = deck_for_gdf(display_gdf, rings=_outer_rings(kg)[display_idx],
+                            bounds=bounds_for(kg, display_idx))
+    except Exception:
+        deck = None
+    if deck is not None:
+        st.pydeck_chart(deck, use_container_width=True)
     else:
-        display_gdf = filtered
-    m = folium_map_for_gdf(display_gdf, popup_fields=popup_fields)
-    st_folium(m, width="100%", height=800)
+        from streamlit_folium import st_folium
+        m = _build_map(search_code, village_sel, group_sel, _frame_key(kg))
+        st_folium(m, width="100%", height=800)